@@ -1,14 +1,38 @@
+import asyncio
+import hashlib
 import json
+import logging
+import os
 import sqlite3
+from collections.abc import Iterator
 from pathlib import Path
 
 import ollama
 
+from create_confirmation_table import TABLE_NAME, pending_llm_condition
+from db import close_conn, get_conn
 from llm_metadata import FIELD_LLM_METADATA, FieldLLMMetadata
 
+logger = logging.getLogger(__name__)
+
 MODEL = "llama3.2:latest"
 DB_PATH = Path("DB") / "confirmation.db"
 EXTERNAL_DATA_DIR = Path("External_Data")
+DEFAULT_NUM_PARALLEL = 4
+
+
+def _read_num_parallel() -> int:
+    # Ollama treats 0 as "auto"; the parser needs a positive bound, so missing,
+    # empty, non-numeric, zero or negative values fall back to the default.
+    try:
+        value = int(os.environ.get("OLLAMA_NUM_PARALLEL") or DEFAULT_NUM_PARALLEL)
+    except ValueError:
+        return DEFAULT_NUM_PARALLEL
+    return value if value > 0 else DEFAULT_NUM_PARALLEL
+
+
+# Upper bound on in-flight Ollama requests; keep in line with the server's OLLAMA_NUM_PARALLEL.
+OLLAMA_NUM_PARALLEL = _read_num_parallel()
 
 
 def _has_value(value) -> bool:
@@ -19,43 +43,61 @@ def _has_value(value) -> bool:
     return True
 
 
-def _extract_column_value(raw_value, metadata: FieldLLMMetadata):
-    user_prompt = (
-        f"{metadata.few_shot}\n\n"
-        f"Input:\n{raw_value}\n\n"
-        "Return ONLY the JSON object."
-    )
+async def _extract_column_value_async(
+    client: ollama.AsyncClient,
+    raw_value,
+    metadata: FieldLLMMetadata,
+    semaphore: asyncio.Semaphore,
+):
+    # Only the input varies between calls; everything else is prebuilt on the metadata.
+    user_prompt = metadata.user_prefix + str(raw_value) + metadata.user_suffix
 
-    response = ollama.chat(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": metadata.system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        format=metadata.format_schema,
-        options={"temperature": 0.0},
-    )
-    parsed = json.loads(response["message"]["content"])
-    return parsed.get(metadata.output_key)
+    async with semaphore:
+        response = await client.chat(
+            model=MODEL,
+            messages=[
+                metadata.system_message,
+                {"role": "user", "content": user_prompt},
+            ],
+            format=metadata.format_schema,
+            options={"temperature": 0.0},
+        )
+    parsed_value = metadata.parse_fn(response["message"]["content"])
+    if parsed_value is not None and not metadata.validator(parsed_value):
+        # Handled like a failed call: logged, not written, not cached, retried next run.
+        raise ValueError(f"rejected invalid value {parsed_value!r}")
+    return parsed_value
 
 
-def _fetch_rows(conn: sqlite3.Connection):
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT
-            id,
-            currency, currency_LLM,
-            settlement_amount, settlement_amount_LLM,
-            buy_sell, buy_sell_LLM,
-            isin, isin_LLM,
-            settlement_date, settlement_date_LLM,
-            SSI, SSI_LLM
-        FROM confirmation_data
-        """
+# SQL text is built once per column so sqlite3's statement cache reuses the prepared statements.
+_PENDING_ROWS_SQL = {
+    metadata.llm_column: (
+        f"SELECT id FROM {TABLE_NAME} "
+        f"WHERE {pending_llm_condition(metadata.llm_column)} ORDER BY id"
     )
-    return cursor.fetchall()
+    for metadata in FIELD_LLM_METADATA.values()
+}
+_UPDATE_LLM_SQL = {
+    metadata.llm_column: f"UPDATE {TABLE_NAME} SET {metadata.llm_column} = ? WHERE id = ?"
+    for metadata in FIELD_LLM_METADATA.values()
+}
+# Per-field hash seeds: cached answers are only reused for the same model and prompt.
+_CACHE_KEY_SEEDS = {
+    metadata.llm_column: hashlib.sha1(f"{MODEL}\0{metadata.prompt_fingerprint}\0".encode("utf-8"))
+    for metadata in FIELD_LLM_METADATA.values()
+}
+_CACHE_LOOKUP_SQL = "SELECT parsed FROM llm_cache WHERE field = ? AND raw_hash = ?"
+_CACHE_STORE_SQL = "INSERT OR REPLACE INTO llm_cache (field, raw_hash, parsed) VALUES (?, ?, ?)"
+
+
+def _iter_pending_row_ids(cursor: sqlite3.Cursor, metadata: FieldLLMMetadata) -> Iterator[int]:
+    """Yield ids of rows whose LLM column for this field is still empty.
+
+    Ids are streamed from the cursor rather than fetched into a list, so the
+    cursor must not run another statement until the iterator is exhausted.
+    """
+    for (row_id,) in cursor.execute(_PENDING_ROWS_SQL[metadata.llm_column]):
+        yield row_id
 
 
 def _load_transaction_text(row_id: int, base_dir: Path = EXTERNAL_DATA_DIR) -> str | None:
@@ -65,52 +107,160 @@ def _load_transaction_text(row_id: int, base_dir: Path = EXTERNAL_DATA_DIR) -> s
     return file_path.read_text(encoding="utf-8")
 
 
-def _update_llm_column(conn: sqlite3.Connection, row_id: int, llm_column: str, value) -> None:
-    cursor = conn.cursor()
-    cursor.execute(
-        f"UPDATE confirmation_data SET {llm_column} = ? WHERE id = ?",
-        (value, row_id),
+def _update_llm_column(cursor: sqlite3.Cursor, llm_column: str, updates) -> None:
+    """Write all (value, row_id) updates for one LLM column with a single executemany."""
+    cursor.executemany(_UPDATE_LLM_SQL[llm_column], updates)
+
+
+def _ensure_llm_cache_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            field TEXT,
+            raw_hash BLOB,
+            parsed TEXT,
+            PRIMARY KEY (field, raw_hash)
+        )
+        """
     )
 
 
-def process_new_raw_rows(db_path: Path = DB_PATH) -> int:
-    conn = sqlite3.connect(db_path)
-    updated_values = 0
+def _cache_key(metadata: FieldLLMMetadata, raw_value) -> tuple[str, bytes]:
+    raw_hash = _CACHE_KEY_SEEDS[metadata.llm_column].copy()
+    raw_hash.update(str(raw_value).encode("utf-8"))
+    return metadata.llm_column, raw_hash.digest()
 
-    try:
-        rows = _fetch_rows(conn)
-        for row in rows:
-            row_id = row["id"]
+
+def _lookup_cached_value(cursor: sqlite3.Cursor, cache_key: tuple[str, bytes]):
+    row = cursor.execute(_CACHE_LOOKUP_SQL, cache_key).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def _store_cached_values(cursor: sqlite3.Cursor, cached_values) -> None:
+    cursor.executemany(
+        _CACHE_STORE_SQL,
+        [(field, raw_hash, json.dumps(value)) for (field, raw_hash), value in cached_values.items()],
+    )
+
+
+def _collect_work_items(
+    cursor: sqlite3.Cursor,
+    metadata: FieldLLMMetadata,
+    transaction_texts: dict,
+):
+    """Return (row_id, cache_key, transaction_text) for every missing LLM value of one field."""
+    work_items = []
+    for row_id in _iter_pending_row_ids(cursor, metadata):
+        if row_id not in transaction_texts:
             transaction_text = _load_transaction_text(row_id)
             if not _has_value(transaction_text):
-                print(
-                    f"Row {row_id}: skipped (missing or empty "
-                    f"External_Data/TX{row_id:06d}.txt)"
+                logger.warning(
+                    "Row %s: skipped (missing or empty External_Data/TX%06d.txt)",
+                    row_id,
+                    row_id,
                 )
-                continue
+                transaction_text = None
+            transaction_texts[row_id] = transaction_text
 
-            for metadata in FIELD_LLM_METADATA.values():
-                llm_value = row[metadata.llm_column]
+        transaction_text = transaction_texts[row_id]
+        if transaction_text is not None:
+            work_items.append((row_id, _cache_key(metadata, transaction_text), transaction_text))
+    return work_items
 
-                # Process only missing LLM outputs using the transaction text file as input.
-                if _has_value(llm_value):
-                    continue
 
-                parsed_value = _extract_column_value(transaction_text, metadata)
-                _update_llm_column(conn, row_id, metadata.llm_column, parsed_value)
-                updated_values += 1
+async def _process_field_async(
+    cursor: sqlite3.Cursor,
+    client: ollama.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    metadata: FieldLLMMetadata,
+    transaction_texts: dict,
+) -> int:
+    work_items = _collect_work_items(cursor, metadata, transaction_texts)
 
-                print(
-                    f"Row {row_id}: {metadata.source_column} -> "
-                    f"{metadata.llm_column} = {parsed_value}"
-                )
+    # Identical inputs are answered from llm_cache or sent to the LLM once.
+    resolved = {}
+    pending = {}
+    for _, cache_key, transaction_text in work_items:
+        if cache_key in resolved or cache_key in pending:
+            continue
+        cached_value = _lookup_cached_value(cursor, cache_key)
+        if cached_value is not None:
+            resolved[cache_key] = cached_value
+        else:
+            pending[cache_key] = transaction_text
 
-        conn.commit()
-        return updated_values
-    finally:
-        conn.close()
+    tasks = [
+        asyncio.create_task(
+            _extract_column_value_async(client, transaction_text, metadata, semaphore)
+        )
+        for transaction_text in pending.values()
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    new_cached_values = {}
+    for cache_key, parsed_value in zip(pending, results):
+        resolved[cache_key] = parsed_value
+        # Null answers are not cached so they are retried on the next run.
+        if parsed_value is not None and not isinstance(parsed_value, Exception):
+            new_cached_values[cache_key] = parsed_value
+
+    updates = []
+    for row_id, cache_key, _ in work_items:
+        parsed_value = resolved[cache_key]
+        if isinstance(parsed_value, Exception):
+            logger.warning(
+                "Row %s: %s -> %s failed (%s)",
+                row_id,
+                metadata.source_column,
+                metadata.llm_column,
+                parsed_value,
+            )
+            continue
+
+        updates.append((parsed_value, row_id))
+        logger.debug(
+            "Row %s: %s -> %s = %s",
+            row_id,
+            metadata.source_column,
+            metadata.llm_column,
+            parsed_value,
+        )
+
+    # One transaction per field; rolled back if any write fails.
+    with cursor.connection:
+        _update_llm_column(cursor, metadata.llm_column, updates)
+        _store_cached_values(cursor, new_cached_values)
+    return len(updates)
+
+
+async def _process_new_raw_rows_async(conn: sqlite3.Connection) -> int:
+    client = ollama.AsyncClient()
+    semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+    # One cursor serves every query and write of the run.
+    cursor = conn.cursor()
+    transaction_texts = {}
+    updated_values = 0
+
+    # Fields are processed one at a time so consecutive requests share the same
+    # system prompt prefix on the Ollama server.
+    for metadata in FIELD_LLM_METADATA.values():
+        updated_values += await _process_field_async(
+            cursor, client, semaphore, metadata, transaction_texts
+        )
+    return updated_values
+
+
+def process_new_raw_rows(db_path: Path = DB_PATH) -> int:
+    conn = get_conn(db_path)
+    _ensure_llm_cache_table(conn)
+    updated_values = asyncio.run(_process_new_raw_rows_async(conn))
+    logger.info("Completed. Updated %s LLM column value(s).", updated_values)
+    return updated_values
 
 
 if __name__ == "__main__":
-    count = process_new_raw_rows()
-    print(f"Completed. Updated {count} LLM column value(s).")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        process_new_raw_rows()
+    finally:
+        close_conn(DB_PATH)
@@ -1,46 +1,104 @@
-﻿import sqlite3
+import sqlite3
 from pathlib import Path
 
+from db import DB_PATH, close_conn, get_conn
 
-def create_confirmation_table(db_path: Path = Path("DB") / "confirmation.db") -> None:
-    """Create the confirmation table with source and LLM columns."""
+# Bump when COLUMNS changes; existing databases are upgraded by migrate_schema().
+SCHEMA_VERSION = 2
+TABLE_NAME = "confirmation_data"
+
+# Column name -> declaration, in table order. id and creation_date keep their
+# constraints in SCHEMA_SQL; every other column can be added with ALTER TABLE.
+COLUMNS = {
+    "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "currency": "TEXT",
+    "currency_LLM": "TEXT",
+    "currency_validation": "TEXT",
+    "settlement_amount": "REAL",
+    "settlement_amount_LLM": "TEXT",
+    "settlement_amount_validation": "TEXT",
+    "buy_sell": "TEXT",
+    "buy_sell_LLM": "TEXT",
+    "buy_sell_validation": "TEXT",
+    "isin": "TEXT",
+    "isin_LLM": "TEXT",
+    "isin_validation": "TEXT",
+    "settlement_date": "TEXT",
+    "settlement_date_LLM": "TEXT",
+    "settlement_date_validation": "TEXT",
+    "SSI": "TEXT",
+    "SSI_LLM": "TEXT",
+    "SSI_validation": "TEXT",
+    "creation_date": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+}
+
+SCHEMA_SQL = (
+    f"CREATE TABLE IF NOT EXISTS {TABLE_NAME} (\n"
+    + ",\n".join(f"    {name} {declaration}" for name, declaration in COLUMNS.items())
+    + "\n)"
+)
+
+LLM_COLUMNS = [name for name in COLUMNS if name.endswith("_LLM")]
+
+
+def pending_llm_condition(llm_column: str) -> str:
+    """SQL condition for rows whose LLM column still needs to be filled.
+
+    Shared by the parser query and the partial indexes so SQLite can match them.
+    """
+    return f"{llm_column} IS NULL OR TRIM({llm_column}) = ''"
+
+
+def migrate_schema(conn: sqlite3.Connection) -> None:
+    """Add any columns missing from an older confirmation_data table."""
+    (user_version,) = conn.execute("PRAGMA user_version").fetchone()
+    if user_version >= SCHEMA_VERSION:
+        return
+
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")}
+    with conn:
+        for name, declaration in COLUMNS.items():
+            if name in existing:
+                continue
+            if name == "creation_date":
+                # ALTER TABLE cannot add a column with a non-constant default.
+                declaration = "TIMESTAMP"
+            conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN {name} {declaration}")
+            print(f"Added missing column '{name}' to {TABLE_NAME}")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def create_confirmation_table(db_path: Path = DB_PATH) -> None:
+    """Create or upgrade the confirmation table with source and LLM columns, plus its indexes."""
     db_path.parent.mkdir(parents=True, exist_ok=True)
 
-    conn = sqlite3.connect(db_path)
+    conn = get_conn(db_path)
     cursor = conn.cursor()
 
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS confirmation_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            currency TEXT,
-            currency_LLM TEXT,
-            currency_validation TEXT,
-            settlement_amount REAL,
-            settlement_amount_LLM TEXT,
-            settlement_amount_validation TEXT,
-            buy_sell TEXT,
-            buy_sell_LLM TEXT,
-            buy_sell_validation TEXT,
-            isin TEXT,
-            isin_LLM TEXT,
-            isin_validation TEXT,
-            settlement_date TEXT,
-            settlement_date_LLM TEXT,
-            settlement_date_validation TEXT,
-            SSI TEXT,
-            SSI_LLM TEXT,
-            SSI_validation TEXT,
-            creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    cursor.execute(SCHEMA_SQL)
+    migrate_schema(conn)
+
+    # Partial indexes hold only rows still waiting for an LLM value, so the
+    # parser's pending-row scans shrink as the table gets processed.
+    for llm_column in LLM_COLUMNS:
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_{llm_column}_pending
+            ON {TABLE_NAME}(id)
+            WHERE {pending_llm_condition(llm_column)}
+            """
         )
-        """
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_creation_date ON {TABLE_NAME}(creation_date)"
     )
 
     conn.commit()
-    conn.close()
 
-    print(f"Table 'confirmation_data' is ready in: {db_path}")
+    print(f"Table '{TABLE_NAME}' is ready in: {db_path}")
 
 
 if __name__ == "__main__":
-    create_confirmation_table()
+    try:
+        create_confirmation_table()
+    finally:
+        close_conn(DB_PATH)
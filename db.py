@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+
+DB_PATH = Path("DB") / "confirmation.db"
+
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+)
+
+_connections: dict[Path, sqlite3.Connection] = {}
+_conn_locks: dict[Path, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def get_conn(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    """Return the shared connection for db_path, opening it on first use.
+
+    The connection stays open for the life of the process so SQLite's page
+    cache stays warm and the PRAGMAs are applied only once. Callers must not
+    close it; use close_conn() instead. Code that may run on several threads
+    (the Streamlit dashboard) must go through locked_conn() instead.
+    """
+    key = Path(db_path).resolve()
+    with _registry_lock:
+        conn = _connections.get(key)
+        if conn is None:
+            # Streamlit reruns scripts on worker threads, so the connection is not
+            # pinned to the thread that opened it; locked_conn() serializes its use.
+            conn = sqlite3.connect(key, check_same_thread=False)
+            for pragma in _CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            _connections[key] = conn
+            _conn_locks[key] = threading.Lock()
+    return conn
+
+
+@contextmanager
+def locked_conn(db_path: Path = DB_PATH) -> Iterator[sqlite3.Connection]:
+    """Yield the shared connection for db_path while holding its lock."""
+    conn = get_conn(db_path)
+    with _conn_locks[Path(db_path).resolve()]:
+        yield conn
+
+
+def close_conn(db_path: Path = DB_PATH) -> None:
+    """Close and forget the shared connection for db_path, if one is open.
+
+    Closing checkpoints the WAL back into the database file.
+    """
+    key = Path(db_path).resolve()
+    with _registry_lock:
+        conn = _connections.pop(key, None)
+        _conn_locks.pop(key, None)
+    if conn is not None:
+        conn.close()
@@ -1,4 +1,9 @@
-from dataclasses import dataclass
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Callable
 
 
 @dataclass(frozen=True)
@@ -9,6 +14,104 @@ class FieldLLMMetadata:
     few_shot: str
     system_prompt: str
     format_schema: dict
+    # Client-side check for non-null LLM values; failing values are discarded.
+    validator: Callable[[Any], bool] = field(repr=False, compare=False)
+    # The user turn is user_prefix + input + user_suffix; the JSON-only directive
+    # follows the input so it stays close to the end of the prompt.
+    user_prefix: str = "Input:\n"
+    user_suffix: str = "\n\nReturn ONLY the JSON object."
+    static_prompt: str = field(init=False)
+    system_message: dict = field(init=False, repr=False, compare=False)
+    prompt_fingerprint: str = field(init=False, repr=False, compare=False)
+    parse_fn: Callable[[str], Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Rules and few-shot examples never change per field, so they form a single
+        # system-turn prefix that the Ollama server can keep in its KV cache.
+        object.__setattr__(self, "static_prompt", f"{self.system_prompt}\n\n{self.few_shot}")
+        object.__setattr__(self, "system_message", {"role": "system", "content": self.static_prompt})
+        # Changes whenever anything sent to the model for this field changes.
+        prompt_parts = (
+            self.static_prompt,
+            self.user_prefix,
+            self.user_suffix,
+            json.dumps(self.format_schema, sort_keys=True),
+        )
+        object.__setattr__(
+            self,
+            "prompt_fingerprint",
+            hashlib.sha1("\0".join(prompt_parts).encode("utf-8")).hexdigest(),
+        )
+        field_types = self.format_schema["properties"][self.output_key]["type"]
+        object.__setattr__(
+            self,
+            "parse_fn",
+            _compile_response_parser(self.output_key, "number" in field_types),
+        )
+
+
+_NUMBER_PATTERN = r"(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)"
+_STRING_PATTERN = r'"([^"\\]*)"'
+
+
+def _compile_response_parser(output_key: str, is_number: bool) -> Callable[[str], Any]:
+    """Build a fast parser for the single-key JSON object returned for one field.
+
+    Replies such as {"currency": "USD"} or {"currency": null} are read with a
+    precompiled regex; anything else (escapes, unexpected types, extra keys)
+    falls back to json.loads.
+    """
+    value_pattern = _NUMBER_PATTERN if is_number else _STRING_PATTERN
+    pattern = re.compile(
+        rf'\s*\{{\s*"{re.escape(output_key)}"\s*:\s*(?:{value_pattern}|null)\s*\}}\s*'
+    )
+
+    def parse(content: str):
+        match = pattern.fullmatch(content)
+        if match is None:
+            return json.loads(content).get(output_key)
+        value = match.group(1)
+        if value is None:
+            return None
+        if not is_number:
+            return value
+        # Same int/float split as json.loads.
+        return int(value) if value.lstrip("-").isdigit() else float(value)
+
+    return parse
+
+
+def _is_currency_code(value) -> bool:
+    return isinstance(value, str) and len(value) == 3 and value.isascii() and value.isalpha()
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_buy_sell(value) -> bool:
+    return value in ("BUY", "SELL")
+
+
+def _is_isin(value) -> bool:
+    return isinstance(value, str) and len(value) == 12 and value.isascii() and value.isalnum()
+
+
+_ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _is_iso_date(value) -> bool:
+    if not isinstance(value, str) or not _ISO_DATE_RE.fullmatch(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _is_text(value) -> bool:
+    return isinstance(value, str) and bool(value.strip())
 
 
 GENERAL_SYSTEM_PROMPT = """
@@ -67,6 +170,7 @@ FIELD_LLM_METADATA = {
             field_type="string",
             description="ISO-4217 3-letter currency code",
         ),
+        validator=_is_currency_code,
     ),
     "settlement_amount": FieldLLMMetadata(
         source_column="settlement_amount",
@@ -94,6 +198,7 @@ FIELD_LLM_METADATA = {
             field_type="number",
             description="Normalized numeric settlement amount",
         ),
+        validator=_is_number,
     ),
     "buy_sell": FieldLLMMetadata(
         source_column="buy_sell",
@@ -125,6 +230,7 @@ FIELD_LLM_METADATA = {
             "required": ["buy_sell"],
             "additionalProperties": False,
         },
+        validator=_is_buy_sell,
     ),
     "isin": FieldLLMMetadata(
         source_column="isin",
@@ -148,6 +254,7 @@ FIELD_LLM_METADATA = {
             field_type="string",
             description="12-character ISIN",
         ),
+        validator=_is_isin,
     ),
     "settlement_date": FieldLLMMetadata(
         source_column="settlement_date",
@@ -172,6 +279,7 @@ FIELD_LLM_METADATA = {
             field_type="string",
             description="Settlement date normalized to YYYY-MM-DD",
         ),
+        validator=_is_iso_date,
     ),
     "SSI": FieldLLMMetadata(
         source_column="SSI",
@@ -197,5 +305,6 @@ FIELD_LLM_METADATA = {
             field_type="string",
             description="Standard settlement instruction text",
         ),
+        validator=_is_text,
     ),
 }
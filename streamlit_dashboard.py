@@ -1,12 +1,16 @@
-import sqlite3
+import io
+from datetime import date, timedelta
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+from create_confirmation_table import TABLE_NAME
+from db import locked_conn
+
 
 DB_PATH = Path("DB") / "confirmation.db"
-TABLE_NAME = "confirmation_data"
 VALIDATION_COLUMNS = [
     "currency_validation",
     "settlement_amount_validation",
@@ -15,6 +19,12 @@ VALIDATION_COLUMNS = [
     "settlement_date_validation",
     "SSI_validation",
 ]
+VALIDATION_STATUSES = ["matched", "unmatched"]
+# Validation columns arrive as categoricals over a fixed category order, so status
+# checks compare integer codes; creation_date is parsed by read_sql_query itself.
+# settlement_amount keeps its inferred dtype: SQLite lets text such as "N/A" into
+# the REAL column, and a forced float64 cast would fail on it.
+LOAD_DTYPES = {column: pd.CategoricalDtype(VALIDATION_STATUSES) for column in VALIDATION_COLUMNS}
 DISPLAY_COLUMNS = [
     "id",
     "creation_date",
@@ -40,35 +50,76 @@ DISPLAY_COLUMNS = [
 
 
 @st.cache_data
-def load_data(db_path: Path) -> pd.DataFrame:
-    conn = sqlite3.connect(db_path)
-    query = f"SELECT * FROM {TABLE_NAME}"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-
-def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
-    working = df.copy()
-    working["creation_date"] = pd.to_datetime(working["creation_date"], errors="coerce")
-    working["matched_field_count"] = (
-        (working[VALIDATION_COLUMNS] == "matched").sum(axis=1).astype(int)
-    )
-    working["unmatched_field_count"] = (
-        (working[VALIDATION_COLUMNS] == "unmatched").sum(axis=1).astype(int)
+def load_date_bounds(db_path: Path) -> tuple[int, date | None, date | None]:
+    with locked_conn(db_path) as conn:
+        # Malformed text would sort after every ISO date, so only values SQLite can
+        # parse as dates take part in MIN/MAX; COUNT still covers every row.
+        row_count, min_value, max_value = conn.execute(
+            f"""
+            SELECT
+                COUNT(*),
+                MIN(CASE WHEN date(creation_date) IS NOT NULL THEN creation_date END),
+                MAX(CASE WHEN date(creation_date) IS NOT NULL THEN creation_date END)
+            FROM {TABLE_NAME}
+            """
+        ).fetchone()
+    min_ts = pd.to_datetime(min_value, errors="coerce")
+    max_ts = pd.to_datetime(max_value, errors="coerce")
+    if pd.isna(min_ts) or pd.isna(max_ts):
+        return row_count, None, None
+    return row_count, min_ts.date(), max_ts.date()
+
+
+@st.cache_data
+def load_data(
+    db_path: Path,
+    start_date: date | None = None,
+    end_date: date | None = None,
+) -> pd.DataFrame:
+    if start_date is None or end_date is None:
+        query = f"SELECT * FROM {TABLE_NAME} ORDER BY id"
+        params = None
+    else:
+        # creation_date may carry a time of day, so the end bound is exclusive on the next day.
+        query = (
+            f"SELECT * FROM {TABLE_NAME} "
+            "WHERE creation_date >= ? AND creation_date < ? ORDER BY id"
+        )
+        params = (start_date.isoformat(), (end_date + timedelta(days=1)).isoformat())
+    # Streamlit sessions share the connection across threads, so reads hold its lock.
+    with locked_conn(db_path) as conn:
+        return pd.read_sql_query(
+            query,
+            conn,
+            params=params,
+            dtype=LOAD_DTYPES,
+            parse_dates=["creation_date"],
+        )
+
+
+def add_derived_columns(df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    # load_data hands out a fresh copy from the cache, so columns are added in place.
+    # The row x field status matrices are computed once from the categorical codes
+    # (missing is -1) and reused by the analysis sections.
+    status_codes = np.column_stack(
+        [df[column].cat.codes.to_numpy() for column in VALIDATION_COLUMNS]
     )
-    working["is_fully_matched"] = working["matched_field_count"] == len(VALIDATION_COLUMNS)
-    return working
+    matched_mat = status_codes == VALIDATION_STATUSES.index("matched")
+    unmatched_mat = status_codes == VALIDATION_STATUSES.index("unmatched")
+
+    df["matched_field_count"] = matched_mat.sum(axis=1)
+    df["unmatched_field_count"] = unmatched_mat.sum(axis=1)
+    df["is_fully_matched"] = df["matched_field_count"] == len(VALIDATION_COLUMNS)
+    return df, matched_mat, unmatched_mat
 
 
-def apply_date_filter(df: pd.DataFrame) -> pd.DataFrame:
-    valid_dates = df["creation_date"].dropna()
-    if valid_dates.empty:
+def select_date_range(
+    min_date: date | None, max_date: date | None
+) -> tuple[date | None, date | None]:
+    if min_date is None or max_date is None:
         st.warning("No valid creation_date values found. Showing all rows.")
-        return df
+        return None, None
 
-    min_date = valid_dates.min().date()
-    max_date = valid_dates.max().date()
     quick_range = st.sidebar.selectbox(
         "Quick range",
         [
@@ -116,12 +167,20 @@ def apply_date_filter(df: pd.DataFrame) -> pd.DataFrame:
             start_date = min_date
 
     if start_date > end_date:
+        # An inverted range selects no rows in load_data.
         st.error("Start date cannot be after end date.")
-        return df.iloc[0:0]
+        return start_date, end_date
 
     st.sidebar.caption(f"Active range: {start_date} to {end_date}")
-    mask = df["creation_date"].dt.date.between(start_date, end_date)
-    return df[mask]
+    return start_date, end_date
+
+
+def _for_display(df: pd.DataFrame) -> pd.DataFrame:
+    # Legacy dataframe serialization only understands numpy dtypes, so cast values and
+    # index to object and blank out missing values in one vectorized pass.
+    display = df.astype(object).where(df.notna(), "")
+    display.index = display.index.astype(object)
+    return display
 
 
 def render_kpis(filtered_df: pd.DataFrame) -> None:
@@ -139,14 +198,18 @@ def render_kpis(filtered_df: pd.DataFrame) -> None:
     c4.metric("Avg Matched Fields", f"{avg_matched_fields:.2f} / {len(VALIDATION_COLUMNS)}")
 
 
-def render_match_analysis(filtered_df: pd.DataFrame) -> None:
+def render_match_analysis(
+    filtered_df: pd.DataFrame, matched_mat: np.ndarray, unmatched_mat: np.ndarray
+) -> None:
     if filtered_df.empty:
         st.info("No records found for the selected date range.")
         return
 
     st.subheader("Field-Level Match Rate")
     field_rates = (
-        (filtered_df[VALIDATION_COLUMNS] == "matched").mean().mul(100).round(2).sort_values(ascending=False)
+        pd.Series(matched_mat.mean(axis=0) * 100, index=VALIDATION_COLUMNS)
+        .round(2)
+        .sort_values(ascending=False)
     )
     field_rates.index = field_rates.index.str.replace("_validation", "", regex=False)
     for field_name, rate in field_rates.items():
@@ -161,15 +224,18 @@ def render_match_analysis(filtered_df: pd.DataFrame) -> None:
         .rename_axis("matched_fields")
         .to_frame("transactions")
     )
-    distribution_display = distribution.reset_index()
-    st.markdown(distribution_display.to_html(index=False), unsafe_allow_html=True)
+    # Streamlit 1.19 has no hide_index, so the first column is kept as the index.
+    st.dataframe(_for_display(distribution), use_container_width=True)
 
     st.subheader("Mismatch Hotspots")
-    mismatch_counts = (filtered_df[VALIDATION_COLUMNS] == "unmatched").sum().sort_values(ascending=False)
+    mismatch_counts = (
+        pd.Series(unmatched_mat.sum(axis=0), index=VALIDATION_COLUMNS).sort_values(ascending=False)
+    )
     mismatch_counts.index = mismatch_counts.index.str.replace("_validation", "", regex=False)
-    mismatch_display = mismatch_counts.rename("unmatched_count").reset_index()
-    mismatch_display.columns = ["field", "unmatched_count"]
-    st.markdown(mismatch_display.to_html(index=False), unsafe_allow_html=True)
+    st.dataframe(
+        _for_display(mismatch_counts.rename("unmatched_count").rename_axis("field").to_frame()),
+        use_container_width=True,
+    )
 
 
 def render_transaction_details(filtered_df: pd.DataFrame) -> None:
@@ -178,8 +244,9 @@ def render_transaction_details(filtered_df: pd.DataFrame) -> None:
         st.info("No transactions to display.")
         return
 
-    display_df = filtered_df.copy()
-    display_df["creation_date"] = display_df["creation_date"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    display_df = filtered_df[DISPLAY_COLUMNS].assign(
+        creation_date=filtered_df["creation_date"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    )
 
     transaction_options = [
         f"ID {row.id} | {row.creation_date}" for row in display_df[["id", "creation_date"]].itertuples(index=False)
@@ -190,25 +257,24 @@ def render_transaction_details(filtered_df: pd.DataFrame) -> None:
         return
     selected_id = int(selected_option.split("|")[0].replace("ID", "").strip())
 
-    selected_row = display_df.loc[display_df["id"] == selected_id, DISPLAY_COLUMNS].head(1)
+    selected_row = display_df.loc[display_df["id"] == selected_id].head(1)
     details_df = pd.DataFrame(
         {
             "field": selected_row.columns,
             "value": [str(v) if pd.notna(v) else "" for v in selected_row.iloc[0].tolist()],
         }
     )
-    st.markdown(details_df.to_html(index=False), unsafe_allow_html=True)
+    st.dataframe(_for_display(details_df.set_index("field")), use_container_width=True)
 
     st.subheader("Filtered Transactions")
-    filtered_display = display_df[DISPLAY_COLUMNS].copy()
-    for col in filtered_display.columns:
-        filtered_display[col] = filtered_display[col].map(lambda x: "" if pd.isna(x) else str(x))
-    st.markdown(filtered_display.to_html(index=False), unsafe_allow_html=True)
+    st.dataframe(_for_display(display_df.set_index("id")), use_container_width=True)
 
-    csv_data = display_df[DISPLAY_COLUMNS].to_csv(index=False).encode("utf-8")
+    # Encode straight into a byte buffer instead of building a str and then its bytes.
+    csv_buffer = io.BytesIO()
+    display_df.to_csv(csv_buffer, index=False, encoding="utf-8")
     st.download_button(
         label="Download filtered results (CSV)",
-        data=csv_data,
+        data=csv_buffer.getvalue(),
         file_name="transaction_match_results.csv",
         mime="text/csv",
     )
@@ -223,23 +289,25 @@ def main() -> None:
     except Exception:
         pass
     st.title("Transaction Match Dashboard")
-    st.caption("Match analytics for confirmation_data in SQLite")
+    st.caption(f"Match analytics for {TABLE_NAME} in SQLite")
 
     if not DB_PATH.exists():
         st.error(f"Database not found: {DB_PATH}")
         return
 
-    raw_df = load_data(DB_PATH)
-    if raw_df.empty:
+    row_count, min_date, max_date = load_date_bounds(DB_PATH)
+    if row_count == 0:
         st.warning("No transaction data found.")
         return
 
-    df = add_derived_columns(raw_df)
     st.sidebar.header("Filters")
-    filtered_df = apply_date_filter(df)
+    start_date, end_date = select_date_range(min_date, max_date)
+    filtered_df, matched_mat, unmatched_mat = add_derived_columns(
+        load_data(DB_PATH, start_date, end_date)
+    )
 
     render_kpis(filtered_df)
-    render_match_analysis(filtered_df)
+    render_match_analysis(filtered_df, matched_mat, unmatched_mat)
     render_transaction_details(filtered_df)
 
 
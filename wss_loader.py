@@ -1,11 +1,12 @@
-import sqlite3
 from pathlib import Path
 
 import pandas as pd
 
+from create_confirmation_table import TABLE_NAME
+from db import close_conn, get_conn
+
 DEFAULT_WSS_FILE = Path("utility") / "WSS_Data.xlsx"
 DEFAULT_DB_PATH = Path("DB") / "confirmation.db"
-TARGET_TABLE = "confirmation_data"
 VALID_COLUMNS = [
     "creation_date",
     "currency",
@@ -63,12 +64,15 @@ def load_wss_data_to_db(
     print(f"Columns used: {matched_columns}")
     print(f"Rows to insert: {len(filtered_df)}")
 
-    with sqlite3.connect(db_path) as conn:
-        filtered_df.to_sql(TARGET_TABLE, conn, if_exists="append", index=False)
+    with get_conn(db_path) as conn:
+        filtered_df.to_sql(TABLE_NAME, conn, if_exists="append", index=False)
 
-    print(f"Inserted {len(filtered_df)} row(s) into {TARGET_TABLE}.")
+    print(f"Inserted {len(filtered_df)} row(s) into {TABLE_NAME}.")
     return len(filtered_df)
 
 
 if __name__ == "__main__":
-    load_wss_data_to_db()
+    try:
+        load_wss_data_to_db()
+    finally:
+        close_conn(DEFAULT_DB_PATH)